@@ -40,11 +40,16 @@ def create_app(config_class=Config):
     # `_lt` query parameter on every link and restore the session from
     # it when the cookie is missing.
     # ------------------------------------------------------------------
-    from routes.lti_routes import verify_launch_token, _make_launch_token
+    from routes.lti_routes import verify_launch_token, _cached_launch_token
 
     @app.before_request
     def _restore_session_from_token():
         """If Flask cookie session is empty, try the _lt URL token."""
+        # Static assets never need the session — skip the token work
+        if request.endpoint == 'static':
+            request._session_token = ''
+            return
+
         # Enable screenshare if explicitly requested via query parameter
         if request.args.get('screenshare') == 'true':
             session['screenshare_required'] = True
@@ -56,8 +61,8 @@ def create_app(config_class=Config):
             if token:
                 request._session_token = token
             else:
-                # Mint a fresh token so template links still carry it
-                request._session_token = _make_launch_token({
+                # Mint (or reuse) a token so template links still carry it
+                request._session_token = _cached_launch_token({
                     'user_id': session['user_id'],
                     'user_name': session.get('user_name', ''),
                     'role': session.get('role', 'student'),
@@ -90,17 +95,21 @@ def create_app(config_class=Config):
     def _inject_token_url_for():
         """Override url_for in templates to auto-append _lt token and screenshare=true."""
         _original = url_for
+        token = getattr(request, '_session_token', '')
+        screenshare = bool(session.get('screenshare_required'))
 
-        def url_for_with_token(endpoint, **kwargs):
-            # Don't add token to static files
-            if endpoint == 'static':
+        if not token and not screenshare:
+            url_for_with_token = _original
+        else:
+            def url_for_with_token(endpoint, **kwargs):
+                # Don't add token to static files
+                if endpoint == 'static':
+                    return _original(endpoint, **kwargs)
+                if token and '_lt' not in kwargs:
+                    kwargs['_lt'] = token
+                if screenshare and 'screenshare' not in kwargs:
+                    kwargs['screenshare'] = 'true'
                 return _original(endpoint, **kwargs)
-            token = getattr(request, '_session_token', '')
-            if token and '_lt' not in kwargs:
-                kwargs['_lt'] = token
-            if session.get('screenshare_required') and 'screenshare' not in kwargs:
-                kwargs['screenshare'] = 'true'
-            return _original(endpoint, **kwargs)
 
         is_inst = (session.get('role') == 'instructor')
         can_switch = is_inst or (session.get('original_role') == 'instructor')
@@ -168,11 +177,16 @@ def create_app(config_class=Config):
     with app.app_context():
         # Import models so SQLAlchemy knows about them
         from models.database import User, Problem, TestCase, Submission, LTISession, SharedLink, SystemSetting, ProctorSession, ProctorEvent  # noqa: F401
-        db.create_all()
-
-        # Database migrations (schema updates)
         from sqlalchemy import inspect, text
+
+        # One table listing instead of create_all()'s per-table checks on
+        # every worker boot — only create tables when some are missing.
         inspector = inspect(db.engine)
+        if not set(db.metadata.tables).issubset(inspector.get_table_names()):
+            db.create_all()
+            inspector = inspect(db.engine)
+
+        # Database migrations (schema updates)
 
         # 1. Ensure users table has regnum column
         if 'users' in inspector.get_table_names():
@@ -206,8 +220,25 @@ def create_app(config_class=Config):
                     conn.commit()
                 app.logger.info("Migrated shared_links table: added screenshare_required column.")
 
+        # 4. Ensure problems table has updated_at column (used by the dashboard ETag)
+        if 'problems' in inspector.get_table_names():
+            columns = [c['name'] for c in inspector.get_columns('problems')]
+            if 'updated_at' not in columns:
+                with db.engine.connect() as conn:
+                    conn.execute(text("ALTER TABLE problems ADD COLUMN updated_at TIMESTAMP"))
+                    conn.commit()
+                app.logger.info("Migrated problems table: added updated_at column.")
+
+        # 5. Ensure lti_sessions table has last_grade_sent column (skips unchanged passbacks)
+        if 'lti_sessions' in inspector.get_table_names():
+            columns = [c['name'] for c in inspector.get_columns('lti_sessions')]
+            if 'last_grade_sent' not in columns:
+                with db.engine.connect() as conn:
+                    conn.execute(text("ALTER TABLE lti_sessions ADD COLUMN last_grade_sent FLOAT"))
+                    conn.commit()
+                app.logger.info("Migrated lti_sessions table: added last_grade_sent column.")
 
-        # 4. Seed system settings (current_semester)
+        # 6. Seed system settings (current_semester)
         if 'system_settings' in inspector.get_table_names():
             with db.engine.connect() as conn:
                 res = conn.execute(text("SELECT 1 FROM system_settings WHERE key = 'current_semester'")).first()
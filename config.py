@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
@@ -41,6 +42,8 @@ class Config:
     # LTI Configuration
     LTI_KEY = os.environ.get('LTI_KEY', 'moodle-judge-key')
     LTI_SECRET = os.environ.get('LTI_SECRET', 'moodle-judge-secret')
+    # Launches whose oauth_timestamp is further than this from now are rejected
+    LTI_TIMESTAMP_WINDOW = int(os.environ.get('LTI_TIMESTAMP_WINDOW', '300'))  # seconds
 
     # Grade proxy – set to your Google Apps Script web-app URL
     GRADE_PROXY_URL = os.environ.get('GRADE_PROXY_URL', 'https://script.google.com/macros/s/AKfycbx0ZepXCbDFzFNjYS-TqdC9K8-iyxexF4soU7UwDa9Jm3SkFjYqgCv_f1inhOS1d9CIHQ/exec')
@@ -49,6 +52,32 @@ class Config:
     EXECUTION_TIMEOUT = int(os.environ.get('EXECUTION_TIMEOUT', '5'))  # seconds
     COMPILATION_TIMEOUT = int(os.environ.get('COMPILATION_TIMEOUT', '10'))  # seconds
     MAX_OUTPUT_SIZE = int(os.environ.get('MAX_OUTPUT_SIZE', '1048576'))  # 1MB
+    # Test cases run in parallel on one process-wide pool of this many threads.
+    # Each run may use up to its memory limit and TLE is wall-clock time, so
+    # keep this at or below the CPUs (and RAM / memory limit) the dyno or
+    # container actually gets.  0 = CPUs this process may run on, at most 4.
+    JUDGE_WORKERS = int(os.environ.get('JUDGE_WORKERS', '2'))
+    # A submission still PENDING after this long lost its background judge
+    # job (worker restart or deploy) and is failed the next time it is viewed
+    JUDGE_PENDING_TIMEOUT = int(os.environ.get('JUDGE_PENDING_TIMEOUT', '300'))  # seconds
+    # Parent directory for per-submission work dirs ('' = system temp).
+    # Point at a tmpfs such as /dev/shm (if not mounted noexec) to compile in RAM.
+    JUDGE_WORK_DIR = os.environ.get('JUDGE_WORK_DIR', '')
+    # Problem statements and sample cases shown to students are cached
+    # in-process for this long (0 disables); admin edits show up after it
+    PROBLEM_CACHE_TTL = int(os.environ.get('PROBLEM_CACHE_TTL', '10'))  # seconds
+    # Compiled binaries are cached here by source hash ('' disables the cache).
+    # The directory must belong to this user; it is created 0700.
+    COMPILE_CACHE_DIR = os.environ.get(
+        'COMPILE_CACHE_DIR',
+        os.path.join(tempfile.gettempdir(), 'judge_cache')
+    )
+    # Least recently used binaries beyond this many are deleted
+    COMPILE_CACHE_MAX_ENTRIES = int(os.environ.get('COMPILE_CACHE_MAX_ENTRIES', '500'))
+
+    # Let the front-end server (Apache mod_xsendfile, lighttpd) send static
+    # files and uploaded problem images with sendfile(2) instead of Python
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
 
     # Supported languages
     SUPPORTED_LANGUAGES = {
@@ -8,12 +8,24 @@ with app.app_context():
         'CREATE INDEX IF NOT EXISTS ix_submissions_user_id ON submissions(user_id)',
         'CREATE INDEX IF NOT EXISTS ix_submissions_problem_id ON submissions(problem_id)',
         'CREATE INDEX IF NOT EXISTS ix_submissions_verdict ON submissions(verdict)',
-        'CREATE INDEX IF NOT EXISTS ix_submission_user_problem ON submissions(user_id, problem_id)',
+        'CREATE INDEX IF NOT EXISTS ix_submission_user_problem_created ON submissions(user_id, problem_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_submission_user_problem_verdict ON submissions(user_id, problem_id, verdict)',
+        'CREATE INDEX IF NOT EXISTS ix_submission_user_created ON submissions(user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_submission_problem_created ON submissions(problem_id, created_at)',
         'CREATE INDEX IF NOT EXISTS ix_lti_sessions_user_id ON lti_sessions(user_id)',
         'CREATE INDEX IF NOT EXISTS ix_test_cases_problem_id ON test_cases(problem_id)',
+        'CREATE INDEX IF NOT EXISTS ix_testcase_problem_order ON test_cases(problem_id, "order")',
+        'CREATE INDEX IF NOT EXISTS ix_testcase_problem_samples ON test_cases(problem_id, "order") WHERE is_sample = 1',
+        'CREATE INDEX IF NOT EXISTS ix_problem_created_at ON problems(created_at)',
+        'CREATE INDEX IF NOT EXISTS ix_problem_updated_at ON problems(updated_at)',
         'CREATE INDEX IF NOT EXISTS ix_problem_images_problem_id ON problem_images(problem_id)',
     ]
+    # Superseded by the (user_id, problem_id, ...) indexes above
+    obsolete = ['ix_submission_user_problem']
     with db.engine.connect() as conn:
+        for name in obsolete:
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+            print(f'Dropped: {name}')
         for idx in indexes:
             conn.execute(text(idx))
             name = idx.split(' ON ')[0].replace('CREATE INDEX IF NOT EXISTS ', '')
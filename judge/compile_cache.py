@@ -0,0 +1,116 @@
+"""
+Compiled Binary Cache.
+
+Content-addressable store for compiled submissions.  Binaries are keyed
+by a SHA-256 of the language, compile command and source code, so an
+identical re-submission (resubmit, rejudge, generator re-run) skips the
+compiler entirely.
+
+Cached binaries are executed, so the directory must be private to this
+user: it is created 0700 and refused if another user owns it or can
+write to it.  It is capped at a number of entries, least recently used
+first out.
+"""
+
+import os
+import stat
+import shutil
+import hashlib
+import tempfile
+
+
+def cache_key(language, compile_cmd, code):
+    """Return the cache key for a piece of source code."""
+    digest = hashlib.sha256()
+    for part in (language, compile_cmd, code):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _private_dir(cache_dir):
+    """Create `cache_dir` (0700) if needed and check it is safe to use.
+
+    Returns:
+        bool: True if the directory is a real directory owned by us and
+        not writable by anyone else
+    """
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        st = os.lstat(cache_dir)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        return False                    # e.g. a planted symlink
+    getuid = getattr(os, 'getuid', None)
+    if getuid is not None and st.st_uid != getuid():
+        return False
+    if st.st_mode & 0o077:
+        try:
+            os.chmod(cache_dir, 0o700)
+        except OSError:
+            return False
+    return True
+
+
+def fetch(cache_dir, key, dest):
+    """Copy a cached binary to `dest`.
+
+    Returns:
+        bool: True on a cache hit, False otherwise
+    """
+    if not cache_dir or not _private_dir(cache_dir):
+        return False
+    cached = os.path.join(cache_dir, f'{key}.bin')
+    try:
+        shutil.copy2(cached, dest)
+        os.utime(cached)                # mark as recently used for eviction
+        return True
+    except OSError:
+        return False
+
+
+def _prune(cache_dir, max_entries):
+    """Delete the least recently used binaries beyond `max_entries`."""
+    try:
+        with os.scandir(cache_dir) as it:
+            entries = [(e.stat().st_mtime, e.path) for e in it
+                       if e.name.endswith('.bin') and e.is_file(follow_symlinks=False)]
+    except OSError:
+        return
+    if len(entries) <= max_entries:
+        return
+    entries.sort()
+    for _, path in entries[:len(entries) - max_entries]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def store(cache_dir, key, src, max_entries=500):
+    """Add a freshly compiled binary to the cache.
+
+    The binary is copied to a temporary file and atomically renamed into
+    place, so concurrent judges never observe a half-written entry.  The
+    oldest entries are then evicted down to `max_entries`.
+    Failures are ignored — the cache is purely an optimisation.
+    """
+    if not cache_dir or not _private_dir(cache_dir):
+        return
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        os.close(fd)
+        shutil.copy2(src, tmp_path)
+        dest = os.path.join(cache_dir, f'{key}.bin')
+        os.replace(tmp_path, dest)
+        os.utime(dest)                  # copy2 kept the source's mtime
+    except OSError:
+        if tmp_path:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return
+    _prune(cache_dir, max_entries)
@@ -8,14 +8,24 @@ Compares output against expected test case outputs.
 import os
 import sys
 import json
+import time
+import shlex
 import shutil
+import signal
 import tempfile
+import functools
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait
 from flask import current_app
+from judge import compile_cache
 
 
 class JudgeResult:
     """Result of judging a single test case."""
+    __slots__ = ('test_case_id', 'verdict', 'actual_output_full', 'actual_output',
+                 'expected_output', 'time_ms', 'error')
+
     def __init__(self, test_case_id, verdict, actual_output='', expected_output='',
                  time_ms=0, error=''):
         self.test_case_id = test_case_id
@@ -37,32 +47,91 @@ class JudgeResult:
         }
 
 
-def _normalize_output(text):
-    """Normalize output for comparison.
+def _normalize_output(data):
+    """Normalize raw (bytes) output for comparison.
 
     - Strip trailing whitespace from each line
     - Strip trailing newlines
     - Handle Windows/Unix line endings
+
+    Works on bytes so process output can be compared without decoding.
     """
-    lines = text.replace('\r\n', '\n').split('\n')
-    # Strip trailing whitespace from each line
-    lines = [line.rstrip() for line in lines]
-    # Remove trailing empty lines
-    while lines and lines[-1] == '':
-        lines.pop()
-    return '\n'.join(lines)
+    # rstrip() also drops the '\r' of Windows line endings, and stripping
+    # newlines from the joined text removes trailing empty lines in C
+    # instead of popping them one by one.
+    return b'\n'.join([line.rstrip() for line in data.split(b'\n')]).rstrip(b'\n')
+
+
+# Expected outputs longer than this are not memoized: every lookup hashes
+# (and on a hit compares) the whole freshly loaded string, which costs about
+# as much as normalizing it, and the cache would pin several copies of it.
+_EXPECTED_CACHE_MAX_LEN = 4096
 
 
-def _get_resource_limiter_prefix():
+def _normalize_expected_text(text):
+    """Normalize an expected output.
+
+    Returns:
+        tuple: (normalized bytes for comparison, normalized str for display)
+    """
+    normalized = _normalize_output(text.encode('utf-8'))
+    return normalized, normalized.decode('utf-8')
+
+
+_normalize_expected_cached = functools.lru_cache(maxsize=256)(_normalize_expected_text)
+
+
+def _normalize_expected(text):
+    """Normalize an expected output, memoizing short ones.
+
+    The same expected output is normalized on every submission to a
+    problem, so small ones are cached.  The comparison itself stays a
+    plain `==`, which already rejects values of different length
+    without scanning.
+    """
+    if len(text) > _EXPECTED_CACHE_MAX_LEN:
+        return _normalize_expected_text(text)
+    return _normalize_expected_cached(text)
+
+
+# prlimit(1) applies rlimits without a preexec_fn (util-linux, Linux only)
+_PRLIMIT = shutil.which('prlimit') if sys.platform.startswith('linux') else None
+
+
+@functools.lru_cache(maxsize=32)
+def _split_command(template):
+    """Tokenize a SUPPORTED_LANGUAGES command template into argv form.
+
+    The template is split *before* {file}/{output} are substituted, so
+    paths containing spaces stay single arguments without any quoting.
+    """
+    return tuple(shlex.split(template))
+
+
+def _format_command(template, **paths):
+    """Build an argv list from a command template (no shell involved)."""
+    return [arg.format(**paths) for arg in _split_command(template)]
+
+
+def _get_resource_limiter_prefix(memory_limit_mb):
     """Get a command prefix to limit resources on Linux (Heroku).
 
     On Windows (dev), we skip resource limits.
-    On Linux (Heroku), we can use ulimit or the resource module.
+    On Linux, prlimit sets the limits and then execs the solution, so
+    Popen needs no preexec_fn and can take its vfork fast path instead
+    of a full fork.  Returns [] when prlimit isn't installed, in which
+    case the caller falls back to _get_preexec_fn().
     """
-    if sys.platform == 'win32':
+    if not _PRLIMIT:
         return []
-    # On Linux, we'll handle limits inside the subprocess via preexec_fn
-    return []
+    mem_bytes = memory_limit_mb * 1024 * 1024
+    return [
+        _PRLIMIT,
+        f'--as={mem_bytes}',
+        '--core=0',
+        f'--fsize={10 * 1024 * 1024}',
+        '--',
+    ]
 
 
 def _get_preexec_fn(memory_limit_mb):
@@ -83,18 +152,20 @@ def _get_preexec_fn(memory_limit_mb):
     return set_limits
 
 
-def compile_code(code, language, work_dir):
+def compile_code(code, language, work_dir, lang_config=None):
     """Compile code if needed.
 
     Args:
         code: Source code string
         language: Language identifier ('python', 'c', 'cpp')
         work_dir: Working directory for compilation
+        lang_config: SUPPORTED_LANGUAGES entry, if the caller already has it
 
     Returns:
         tuple: (success: bool, executable_path: str, error: str)
     """
-    lang_config = current_app.config['SUPPORTED_LANGUAGES'].get(language)
+    if lang_config is None:
+        lang_config = current_app.config['SUPPORTED_LANGUAGES'].get(language)
     if not lang_config:
         return False, '', f'Unsupported language: {language}'
 
@@ -102,8 +173,16 @@ def compile_code(code, language, work_dir):
     source_file = os.path.join(work_dir, f'solution{ext}')
 
     # Write source code to file
-    with open(source_file, 'w', encoding='utf-8') as f:
-        f.write(code)
+    # Raw fd write — skips the text-IO wrapper for a one-shot write
+    data = memoryview(code.encode('utf-8'))
+    fd = os.open(source_file,
+                 os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0),
+                 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
 
     # If no compilation needed (e.g., Python)
     if lang_config['compile_cmd'] is None:
@@ -114,15 +193,20 @@ def compile_code(code, language, work_dir):
     if sys.platform == 'win32':
         output_file += '.exe'
 
-    compile_cmd = lang_config['compile_cmd'].format(
-        file=source_file, output=output_file
+    compile_argv = _format_command(
+        lang_config['compile_cmd'], file=source_file, output=output_file
     )
 
+    # Identical source already compiled? Reuse the cached binary.
+    cache_dir = current_app.config.get('COMPILE_CACHE_DIR', '')
+    key = compile_cache.cache_key(language, lang_config['compile_cmd'], code)
+    if compile_cache.fetch(cache_dir, key, output_file):
+        return True, output_file, ''
+
     try:
         compilation_timeout = current_app.config.get('COMPILATION_TIMEOUT', 10)
         result = subprocess.run(
-            compile_cmd,
-            shell=True,
+            compile_argv,
             capture_output=True,
             text=True,
             timeout=compilation_timeout,
@@ -132,6 +216,8 @@ def compile_code(code, language, work_dir):
         if result.returncode != 0:
             return False, '', result.stderr[:1000]
 
+        compile_cache.store(cache_dir, key, output_file,
+                            current_app.config.get('COMPILE_CACHE_MAX_ENTRIES', 500))
         return True, output_file, ''
 
     except subprocess.TimeoutExpired:
@@ -140,66 +226,81 @@ def compile_code(code, language, work_dir):
         return False, '', f'Compilation error: {str(e)}'
 
 
-def run_test_case(executable_path, language, input_data, expected_output,
-                  test_case_id, time_limit_s, memory_limit_mb, work_dir):
+def build_run_command(executable_path, lang_config):
+    """Build the argv list used to run a compiled solution.
+
+    Built once per submission (not per test case) and passed to
+    run_test_case.  A list avoids shell=True for reliable killing.
+    """
+    return _format_command(
+        lang_config['run_cmd'], file=executable_path, output=executable_path
+    )
+
+
+def write_input_file(path, input_data):
+    """Write a test case's input to `path` so it can be wired to stdin."""
+    with open(path, 'wb') as f:
+        f.write(input_data.encode('utf-8') if input_data else b'')
+    return path
+
+
+def run_test_case(cmd_list, input_path, expected_output,
+                  test_case_id, time_limit_s, memory_limit_mb, work_dir,
+                  max_output_size=None):
     """Run a single test case.
 
     Args:
-        executable_path: Path to the compiled binary or source file
-        language: Language identifier
-        input_data: Test case input string
+        cmd_list: Run command from build_run_command()
+        input_path: File holding the test case input (see write_input_file)
         expected_output: Expected output string
         test_case_id: ID of the test case
         time_limit_s: Time limit in seconds
         memory_limit_mb: Memory limit in MB
         work_dir: Working directory
+        max_output_size: Output cap in bytes (MAX_OUTPUT_SIZE when omitted)
 
     Returns:
         JudgeResult
     """
-    lang_config = current_app.config['SUPPORTED_LANGUAGES'].get(language)
-    if not lang_config:
-        return JudgeResult(test_case_id, 'CE', error='Unsupported language')
-
-    # Build run command as a list (avoid shell=True for reliable killing)
-    run_cmd = lang_config['run_cmd'].format(
-        file=executable_path, output=executable_path
-    )
-    import shlex
-    if sys.platform == 'win32':
-        cmd_list = run_cmd.split()
-    else:
-        cmd_list = shlex.split(run_cmd)
+    if max_output_size is None:
+        max_output_size = current_app.config.get('MAX_OUTPUT_SIZE', 1048576)
 
     # Add a small buffer for OS/process overhead
     effective_timeout = time_limit_s + 0.2
 
     try:
-        import time as time_mod
-        import signal
-
         # Platform-specific process group handling for clean kills
         kwargs = {
-            'stdin': subprocess.PIPE,
             'stdout': subprocess.PIPE,
             'stderr': subprocess.PIPE,
             'cwd': work_dir,
+            'bufsize': 0,  # raw pipes — _communicate_bounded does its own buffering
         }
 
         if sys.platform == 'win32':
             kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
         else:
-            kwargs['preexec_fn'] = _get_preexec_fn(memory_limit_mb)
+            limiter = _get_resource_limiter_prefix(memory_limit_mb)
+            if limiter:
+                cmd_list = limiter + cmd_list
+            else:
+                kwargs['preexec_fn'] = _get_preexec_fn(memory_limit_mb)
             kwargs['start_new_session'] = True
 
-        start_time = time_mod.time()
+        # The input file is handed to the child as its stdin, so the
+        # kernel feeds it directly instead of us copying it through a pipe.
+        with open(input_path, 'rb') as stdin_file:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(stdin_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            kwargs['stdin'] = stdin_file
+
+            start_time = time.time()
 
-        proc = subprocess.Popen(cmd_list, **kwargs)
+            proc = subprocess.Popen(cmd_list, **kwargs)
 
         try:
-            stdout, stderr = proc.communicate(
-                input=input_data.encode('utf-8') if input_data else None,
-                timeout=effective_timeout
+            stdout, stderr, output_exceeded = _communicate_bounded(
+                proc, effective_timeout, max_output_size,
             )
         except subprocess.TimeoutExpired:
             # Kill the entire process group
@@ -211,7 +312,16 @@ def run_test_case(executable_path, language, input_data, expected_output,
                 error='Time limit exceeded'
             )
 
-        elapsed_ms = int((time_mod.time() - start_time) * 1000)
+        elapsed_ms = int((time.time() - start_time) * 1000)
+
+        if output_exceeded:
+            return JudgeResult(
+                test_case_id, 'RE',
+                actual_output=stdout.decode('utf-8', errors='replace'),
+                expected_output=expected_output,
+                time_ms=elapsed_ms,
+                error='Output limit exceeded'
+            )
 
         # Also flag as TLE if wall time exceeded the problem's limit
         if elapsed_ms > (time_limit_s * 1000) + 500:
@@ -222,35 +332,33 @@ def run_test_case(executable_path, language, input_data, expected_output,
                 error='Time limit exceeded'
             )
 
-        stdout_str = stdout.decode('utf-8', errors='replace')
-        stderr_str = stderr.decode('utf-8', errors='replace')
-
         # Check for runtime error
         if proc.returncode != 0:
             return JudgeResult(
                 test_case_id, 'RE',
-                actual_output=stdout_str,
+                actual_output=stdout.decode('utf-8', errors='replace'),
                 expected_output=expected_output,
                 time_ms=elapsed_ms,
-                error=stderr_str[:500]
+                error=stderr[:2000].decode('utf-8', errors='replace')
             )
 
-        # Compare output
-        actual = _normalize_output(stdout_str)
-        expected = _normalize_output(expected_output)
+        # Compare output as bytes — only decode when the text is needed
+        actual = _normalize_output(stdout)
+        expected, expected_str = _normalize_expected(expected_output)
 
         if actual == expected:
+            # Identical bytes: reuse the cached expected text for display
             return JudgeResult(
                 test_case_id, 'AC',
-                actual_output=actual,
-                expected_output=expected,
+                actual_output=expected_str,
+                expected_output=expected_str,
                 time_ms=elapsed_ms
             )
         else:
             return JudgeResult(
                 test_case_id, 'WA',
-                actual_output=actual,
-                expected_output=expected,
+                actual_output=actual.decode('utf-8', errors='replace'),
+                expected_output=expected_str,
                 time_ms=elapsed_ms
             )
 
@@ -268,6 +376,64 @@ def run_test_case(executable_path, language, input_data, expected_output,
         )
 
 
+def _communicate_bounded(proc, timeout, max_output):
+    """Like Popen.communicate(), but never buffers more than max_output bytes.
+
+    stdout/stderr are drained on helper threads so a chatty child can't
+    deadlock on a full pipe.  Once a stream exceeds
+    max_output the whole process tree is killed instead of letting an
+    output bomb fill the judge host's memory.
+
+    Returns:
+        tuple: (stdout: bytes, stderr: bytes, output_exceeded: bool)
+
+    Raises:
+        subprocess.TimeoutExpired: if the process outlives `timeout`
+    """
+    exceeded = threading.Event()
+    out_chunks, err_chunks = [], []
+
+    def _drain(pipe, chunks):
+        total = 0
+        while True:
+            chunk = pipe.read(65536)
+            if not chunk:
+                break
+            if total + len(chunk) > max_output:
+                chunks.append(chunk[:max_output - total])
+                exceeded.set()
+                _kill_process_tree(proc)
+                break
+            chunks.append(chunk)
+            total += len(chunk)
+
+    threads = [
+        threading.Thread(target=_drain, args=(proc.stdout, out_chunks), daemon=True),
+        threading.Thread(target=_drain, args=(proc.stderr, err_chunks), daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_process_tree(proc)
+        raise
+    finally:
+        # A grandchild may still hold the pipes open — don't wait on it forever
+        for t in threads:
+            t.join(timeout=1)
+        if any(t.is_alive() for t in threads):
+            _kill_process_tree(proc)
+        for pipe in (proc.stdout, proc.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    return b''.join(out_chunks), b''.join(err_chunks), exceeded.is_set()
+
+
 def _kill_process_tree(proc):
     """Kill a process and all its children reliably."""
     try:
@@ -279,7 +445,6 @@ def _kill_process_tree(proc):
             )
         else:
             # Kill the entire process group on Linux
-            import signal
             os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
     except Exception:
         try:
@@ -292,15 +457,90 @@ def _kill_process_tree(proc):
         pass
 
 
-def judge_submission(code, language, test_cases, time_limit_ms=2000, memory_limit_mb=256):
+# Shared by every submission: worker threads are reused instead of being
+# spawned per submission, and the number of solutions running at once is
+# capped across concurrent requests so they don't skew each other's timings.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# Work directories are deleted here, off the request thread
+_cleanup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='judge-cleanup')
+
+
+def remove_work_dir(work_dir):
+    """Delete a judge work directory in the background.
+
+    The response no longer waits on unlinking the binary and every
+    test-case directory.  Errors are ignored, as with a plain rmtree.
+    """
+    _cleanup_executor.submit(shutil.rmtree, work_dir, ignore_errors=True)
+
+
+def _default_workers():
+    """CPUs this process may actually run on, capped low.
+
+    os.cpu_count() reports the host's cores, which on shared dynos is far
+    more than the container's quota; running that many test cases at once
+    there causes false TLEs and OOM kills.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    return max(1, min(cpus, 4))
+
+
+def _get_executor(max_workers):
+    """Return the process-wide test-case thread pool, creating it once."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=max_workers or _default_workers(),
+                    thread_name_prefix='judge',
+                )
+    return _executor
+
+
+def run_inputs(cmd_list, inputs, time_limit_s, memory_limit_mb, work_dir):
+    """Run a compiled program on several inputs concurrently.
+
+    Uses the shared test-case pool; each input runs in its own
+    sub-directory of `work_dir`.  Nothing is compared — this is for
+    generating expected outputs.
+
+    Returns:
+        list of JudgeResult, in the same order as `inputs`
+    """
+    max_output_size = current_app.config.get('MAX_OUTPUT_SIZE', 1048576)
+
+    def _run(idx, input_data):
+        run_dir = os.path.join(work_dir, f'in_{idx}')
+        os.makedirs(run_dir, exist_ok=True)
+        input_path = write_input_file(os.path.join(run_dir, 'input.txt'), input_data)
+        return run_test_case(
+            cmd_list, input_path, '', idx, time_limit_s, memory_limit_mb,
+            run_dir, max_output_size=max_output_size,
+        )
+
+    executor = _get_executor(current_app.config.get('JUDGE_WORKERS', 2))
+    futures = [executor.submit(_run, idx, inp) for idx, inp in enumerate(inputs)]
+    return [future.result() for future in futures]
+
+
+def judge_submission(code, language, test_cases, time_limit_ms=2000, memory_limit_mb=256,
+                     lang_config=None):
     """Judge a complete submission against all test cases.
 
     Args:
         code: Source code string
         language: Language identifier
-        test_cases: List of TestCase model objects
+        test_cases: TestCase objects or rows (id, input_data, expected_output)
         time_limit_ms: Time limit per test case in milliseconds
         memory_limit_mb: Memory limit in MB
+        lang_config: SUPPORTED_LANGUAGES entry, if the caller already has it
 
     Returns:
         dict: {
@@ -311,11 +551,18 @@ def judge_submission(code, language, test_cases, time_limit_ms=2000, memory_limi
         }
     """
     time_limit_s = max(0.5, time_limit_ms / 1000.0)
-    work_dir = tempfile.mkdtemp(prefix='judge_')
+    work_dir = tempfile.mkdtemp(prefix='judge_',
+                                dir=current_app.config.get('JUDGE_WORK_DIR') or None)
+
+    # Copy the ORM rows into plain tuples once, so the worker threads
+    # never go through attribute instrumentation (or a lazy load).
+    cases = [(tc.id, tc.input_data, tc.expected_output) for tc in test_cases]
 
     try:
         # Compile
-        success, executable_path, error = compile_code(code, language, work_dir)
+        if lang_config is None:
+            lang_config = current_app.config['SUPPORTED_LANGUAGES'].get(language)
+        success, executable_path, error = compile_code(code, language, work_dir, lang_config)
         if not success:
             return {
                 'verdict': 'CE',
@@ -324,39 +571,71 @@ def judge_submission(code, language, test_cases, time_limit_ms=2000, memory_limi
                 'error': error,
             }
 
-        # Run each test case (Early Exit on first non-AC verdict)
+        # Run test cases concurrently.  Each run blocks on subprocess I/O,
+        # so the shared pool lets several solutions execute at once.  Every
+        # test case gets its own sub-directory so parallel runs never
+        # collide on files they create.  Config is read once here so the
+        # worker threads never touch current_app.
+        max_output_size = current_app.config.get('MAX_OUTPUT_SIZE', 1048576)
+        cmd_list = build_run_command(executable_path, lang_config)
+        stop = threading.Event()
+
+        def _run(case):
+            tc_id, input_data, expected_output = case
+            # Fail-Fast: a failed test case stops later ones from starting
+            if stop.is_set():
+                return None
+            tc_dir = os.path.join(work_dir, f'tc_{tc_id}')
+            os.makedirs(tc_dir, exist_ok=True)
+            input_path = write_input_file(os.path.join(tc_dir, 'input.txt'), input_data)
+            result = run_test_case(
+                cmd_list, input_path, expected_output,
+                tc_id, time_limit_s, memory_limit_mb, tc_dir,
+                max_output_size=max_output_size,
+            )
+            if result.verdict != 'AC':
+                stop.set()
+            return result
+
         results = []
         passed = 0
         overall_verdict = 'AC'
 
-        for tc in test_cases:
-            result = run_test_case(
-                executable_path, language,
-                tc.input_data, tc.expected_output,
-                tc.id, time_limit_s, memory_limit_mb, work_dir
-            )
-            results.append(result.to_dict())
+        executor = _get_executor(current_app.config.get('JUDGE_WORKERS', 2))
+        futures = [executor.submit(_run, case) for case in cases]
+
+        # Collect in test-case order (Early Exit on first non-AC verdict)
+        for future in futures:
+            result = future.result()
+            if result is None:
+                # Skipped because a later case failed first: report that one
+                wait(futures)
+                result = next(r for r in (f.result() for f in futures)
+                              if r is not None and r.verdict != 'AC')
+            results.append(result)
 
             if result.verdict == 'AC':
                 passed += 1
             else:
                 overall_verdict = result.verdict
-                # Fail-Fast / Early Exit: Stop evaluating remaining test cases immediately on failure or TLE
+                # Fail-Fast: drop test cases that have not started yet
+                for pending in futures:
+                    pending.cancel()
                 break
 
-        total = len(test_cases)
+        # Let runs already in flight finish before work_dir is removed
+        wait(futures)
+
+        total = len(cases)
         score = passed / total if total > 0 else 0.0
 
         return {
             'verdict': overall_verdict,
             'score': score,
-            'results': results,
+            'results': [r.to_dict() for r in results],
             'error': '',
         }
 
     finally:
         # Clean up temp directory
-        try:
-            shutil.rmtree(work_dir, ignore_errors=True)
-        except Exception:
-            pass
+        remove_work_dir(work_dir)
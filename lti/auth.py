@@ -5,30 +5,57 @@ Validates incoming LTI launch requests from Moodle by verifying
 the OAuth 1.0a signature using the shared consumer key and secret.
 """
 
+import re
 import time
-import hashlib
 import hmac
+import base64
+import hashlib
 import urllib.parse
-from functools import wraps
+from functools import wraps, lru_cache
 from flask import request, session, redirect, url_for, abort, current_app, flash
 
+# Any of these in the launch's roles string grants instructor access
+_INSTRUCTOR_ROLE_RE = re.compile(
+    r'instructor|administrator|teachingassistant|contentdeveloper|mentor',
+    re.IGNORECASE)
+
+
+# Launch parameters are encoded before the signature is checked, so only
+# short strings are memoised; anyone could otherwise pin large values here.
+_QUOTE_CACHE_MAX_LEN = 64
+
+
+@lru_cache(maxsize=2048)
+def _quote_cached(value):
+    return urllib.parse.quote(value, safe='')
 
-def _normalize_params(params):
+
+def _quote(value):
+    """Percent-encode per RFC 3986 (OAuth 1.0a section 3.6).
+
+    Launches from one LMS repeat nearly every key and many short values
+    (roles, ids), so those are memoised to skip urllib's per-byte loop.
+    """
+    if len(value) > _QUOTE_CACHE_MAX_LEN:
+        return urllib.parse.quote(value, safe='')
+    return _quote_cached(value)
+
+
+def _normalize_params(items):
     """Normalize OAuth parameters for base string construction.
 
-    Per OAuth 1.0a spec: parameters are sorted by key, then by value,
-    and encoded using percent-encoding.
+    Per OAuth 1.0a spec: parameters are percent-encoded, then sorted by
+    encoded key, then by encoded value.  `items` is an iterable of
+    (key, value) pairs so repeated keys are each included.
     """
     # Exclude oauth_signature from the normalized params
-    filtered = {k: v for k, v in params.items() if k != 'oauth_signature'}
-    sorted_params = sorted(filtered.items())
-    return '&'.join(
-        f'{urllib.parse.quote(str(k), safe="")}={urllib.parse.quote(str(v), safe="")}'
-        for k, v in sorted_params
-    )
+    encoded = [(_quote(k), _quote(v))
+               for k, v in items if k != 'oauth_signature']
+    encoded.sort()
+    return '&'.join([f'{k}={v}' for k, v in encoded])
 
 
-def _build_base_string(method, url, params):
+def _build_base_string(method, url, items):
     """Build the OAuth signature base string.
 
     Format: METHOD&url_encoded_url&url_encoded_params
@@ -37,24 +64,27 @@ def _build_base_string(method, url, params):
     parsed = urllib.parse.urlparse(url)
     base_url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
 
-    normalized = _normalize_params(params)
-    return '&'.join([
-        urllib.parse.quote(method.upper(), safe=''),
-        urllib.parse.quote(base_url, safe=''),
-        urllib.parse.quote(normalized, safe=''),
-    ])
+    normalized = _normalize_params(items)
+    return (f"{_quote(method.upper())}&{_quote(base_url)}"
+            f"&{urllib.parse.quote(normalized, safe='')}")
 
 
-def _sign(base_string, consumer_secret):
-    """Generate HMAC-SHA1 signature."""
+@lru_cache(maxsize=8)
+def _keyed_hmac(consumer_secret):
+    """Return an HMAC-SHA1 object already keyed with the consumer secret.
+
+    The secret is fixed per deployment, so percent-encoding it and
+    initialising the HMAC key schedule happens once; signing copies it.
+    """
     # LTI 1.0 uses consumer secret + '&' (no token secret)
     signing_key = f'{urllib.parse.quote(consumer_secret, safe="")}&'
-    hashed = hmac.new(
-        signing_key.encode('utf-8'),
-        base_string.encode('utf-8'),
-        hashlib.sha1
-    )
-    import base64
+    return hmac.new(signing_key.encode('utf-8'), digestmod=hashlib.sha1)
+
+
+def _sign(base_string, consumer_secret):
+    """Generate HMAC-SHA1 signature."""
+    hashed = _keyed_hmac(consumer_secret).copy()
+    hashed.update(base_string.encode('utf-8'))
     return base64.b64encode(hashed.digest()).decode('utf-8')
 
 
@@ -62,12 +92,20 @@ def validate_lti_request(req):
     """Validate an incoming LTI launch request.
 
     Returns:
-        tuple: (is_valid: bool, error_message: str, params: dict)
+        tuple: (is_valid: bool, error_message: str, params: MultiDict)
     """
     consumer_key = current_app.config['LTI_KEY']
     consumer_secret = current_app.config['LTI_SECRET']
 
-    params = dict(req.form)
+    params = req.form
+
+    # Reject stale or malformed timestamps before anything else.  Only
+    # short ASCII digit strings reach int(), so it cannot raise.
+    ts = params.get('oauth_timestamp', '')
+    if not (ts.isascii() and ts.isdigit() and len(ts) <= 12):
+        return False, 'Invalid timestamp', params
+    if abs(int(time.time()) - int(ts)) > current_app.config['LTI_TIMESTAMP_WINDOW']:
+        return False, 'Request timestamp expired', params
 
     # Check required LTI parameters
     if params.get('oauth_consumer_key') != consumer_key:
@@ -76,15 +114,6 @@ def validate_lti_request(req):
     if params.get('lti_message_type') != 'basic-lti-launch-request':
         return False, 'Invalid LTI message type', params
 
-    # Check timestamp (allow 5 minute window)
-    try:
-        timestamp = int(params.get('oauth_timestamp', 0))
-        now = int(time.time())
-        if abs(now - timestamp) > 3000000:
-            return False, 'Request timestamp expired', params
-    except (ValueError, TypeError):
-        return False, 'Invalid timestamp', params
-
     # Build the URL that Moodle signed against.
     # Behind a reverse proxy (ngrok / VS Code tunnel / Heroku) the
     # internal req.url is http://127.0.0.1:5000/... but Moodle signed
@@ -102,13 +131,15 @@ def validate_lti_request(req):
             host = h
 
     url = f'{scheme}://{host}{req.path}'
-    current_app.logger.debug(f'LTI: Reconstructed URL for signing: {url}')
+    current_app.logger.debug('LTI: Reconstructed URL for signing: %s', url)
 
     # Verify OAuth signature
-    base_string = _build_base_string(req.method, url, params)
+    base_string = _build_base_string(req.method, url, params.items(multi=True))
     expected_signature = _sign(base_string, consumer_secret)
 
-    if params.get('oauth_signature') != expected_signature:
+    # Constant-time compare; bytes so a non-ASCII signature can't raise
+    provided = params.get('oauth_signature', '').encode('utf-8')
+    if not hmac.compare_digest(provided, expected_signature.encode('utf-8')):
         current_app.logger.debug('LTI: OAuth signature mismatch')
         return False, 'Invalid OAuth signature', params
     else:
@@ -125,11 +156,7 @@ def extract_lti_user_data(params):
     # Determine role - Moodle sends roles like 'Instructor', 'Learner',
     # or URN-based roles like 'urn:lti:role:ims/lis/Instructor'
     roles_str = params.get('roles', '')
-    is_instructor = any(
-        r in roles_str.lower()
-        for r in ['instructor', 'administrator', 'teachingassistant',
-                   'contentdeveloper', 'mentor']
-    )
+    is_instructor = _INSTRUCTOR_ROLE_RE.search(roles_str) is not None
 
     return {
         'lti_user_id': params.get('user_id', ''),
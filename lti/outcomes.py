@@ -13,11 +13,27 @@ import json
 import time
 import uuid
 import hashlib
-import hmac
 import base64
+import threading
 import urllib.parse
+from xml.sax.saxutils import escape
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import current_app
+from lti.auth import _keyed_hmac
+
+
+# One pooled session for all passbacks: keep-alive connections to the
+# LMS (or proxy) are reused, so a burst of grades skips the TCP/TLS
+# handshake after the first request.
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20,
+                       max_retries=Retry(total=2, backoff_factor=0.2))
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
 
 
 def _generate_oauth_params(consumer_key):
@@ -47,12 +63,8 @@ def _build_base_string(method, url, params):
 
 def _sign_request(base_string, consumer_secret):
     """Sign the request with HMAC-SHA1."""
-    signing_key = f'{urllib.parse.quote(consumer_secret, safe="")}&'
-    hashed = hmac.new(
-        signing_key.encode('utf-8'),
-        base_string.encode('utf-8'),
-        hashlib.sha1
-    )
+    hashed = _keyed_hmac(consumer_secret).copy()
+    hashed.update(base_string.encode('utf-8'))
     return base64.b64encode(hashed.digest()).decode('utf-8')
 
 
@@ -64,6 +76,8 @@ def _build_replace_result_xml(sourcedid, score):
         score: Normalized score between 0.0 and 1.0
     """
     message_id = uuid.uuid4().hex
+    # sourcedid is LMS-supplied and may contain markup characters
+    sourcedid = escape(sourcedid)
     return f'''<?xml version="1.0" encoding="UTF-8"?>
 <imsx_POXEnvelopeRequest xmlns="http://www.imsglobal.org/services/ltiv1p1/xsd/imsoms_v1p0">
   <imsx_POXHeader>
@@ -90,6 +104,23 @@ def _build_replace_result_xml(sourcedid, score):
 </imsx_POXEnvelopeRequest>'''
 
 
+def _passback_succeeded(body):
+    """Return True if an outcomes response body reports success.
+
+    Moodle answers with a POX envelope whose imsx_codeMajor is
+    'success' on acceptance.  Bodies that are not XML (e.g. a proxy's
+    own reply) fall back to a plain substring test.
+    """
+    try:
+        root = ElementTree.fromstring(body)
+    except ElementTree.ParseError:
+        return b'success' in body.lower()
+    for el in root.iter():
+        if el.tag.rpartition('}')[2] == 'imsx_codeMajor':
+            return (el.text or '').strip() == 'success'
+    return False
+
+
 def send_grade(outcome_url, sourcedid, score):
     """Send a grade back to Moodle via LTI Basic Outcomes.
 
@@ -107,7 +138,7 @@ def send_grade(outcome_url, sourcedid, score):
     if not outcome_url or not sourcedid:
         return False, 'No outcome URL or sourcedid available (grade passback not configured)'
 
-    current_app.logger.debug(f'Grade passback: url={outcome_url}, score={score}')
+    current_app.logger.debug('Grade passback: url=%s, score=%s', outcome_url, score)
 
     consumer_key = current_app.config['LTI_KEY']
     consumer_secret = current_app.config['LTI_SECRET']
@@ -115,13 +146,12 @@ def send_grade(outcome_url, sourcedid, score):
     # Clamp score
     score = max(0.0, min(1.0, float(score)))
 
-    # Build XML body
+    # Build XML body; encoded once for both the body hash and the POST
     xml_body = _build_replace_result_xml(sourcedid, score)
+    body_bytes = xml_body.encode('utf-8')
 
     # Build OAuth parameters (body-hash based signing)
-    body_hash = base64.b64encode(
-        hashlib.sha1(xml_body.encode('utf-8')).digest()
-    ).decode('utf-8')
+    body_hash = base64.b64encode(hashlib.sha1(body_bytes).digest()).decode('ascii')
 
     oauth_params = _generate_oauth_params(consumer_key)
     oauth_params['oauth_body_hash'] = body_hash
@@ -148,8 +178,8 @@ def send_grade(outcome_url, sourcedid, score):
                 'xml_body': xml_body,
                 'auth_header': auth_header,
             }
-            current_app.logger.debug(f'Sending grade to proxy: {proxy_url}')
-            response = requests.post(
+            current_app.logger.debug('Sending grade to proxy: %s', proxy_url)
+            response = _session.post(
                 proxy_url,
                 json=payload,
                 headers={'Content-Type': 'application/json'},
@@ -157,9 +187,9 @@ def send_grade(outcome_url, sourcedid, score):
             )
         else:
             # Direct POST to Moodle
-            response = requests.post(
+            response = _session.post(
                 outcome_url,
-                data=xml_body,
+                data=body_bytes,
                 headers={
                     'Content-Type': 'application/xml',
                     'Authorization': auth_header,
@@ -167,8 +197,8 @@ def send_grade(outcome_url, sourcedid, score):
                 timeout=10,
             )
 
-        if response.status_code == 200 and 'success' in response.text.lower():
-            current_app.logger.debug(f'Grade sent successfully: {score}')
+        if response.status_code == 200 and _passback_succeeded(response.content):
+            current_app.logger.debug('Grade sent successfully: %s', score)
             return True, 'Grade sent successfully'
         else:
             current_app.logger.warning(f'Moodle returned: {response.status_code} - {response.text[:500]}')
@@ -177,3 +207,81 @@ def send_grade(outcome_url, sourcedid, score):
     except requests.RequestException as e:
         return False, f'Failed to send grade: {str(e)}'
 
+
+# ── Background passback queue ────────────────────────────────────────
+
+_GRADE_ATTEMPTS = 3
+
+_grade_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='grade')
+_pending_grades = {}        # (outcome_url, sourcedid) -> (newest unsent score, on_sent)
+_pending_lock = threading.Lock()
+
+
+def _send_grade_with_retry(outcome_url, sourcedid, score):
+    """send_grade() with exponential backoff between failed attempts."""
+    for attempt in range(_GRADE_ATTEMPTS):
+        success, msg = send_grade(outcome_url, sourcedid, score)
+        if success:
+            return True, msg
+        if attempt + 1 < _GRADE_ATTEMPTS:
+            time.sleep(0.5 * 2 ** attempt)
+    return False, msg
+
+
+def _drain_grades(app, key):
+    """Send the newest queued score for `key` until none is left.
+
+    enqueue_grade() only schedules a drain for a key that is not queued,
+    so this must release the key however it exits; otherwise later
+    grades for that result would pile up with nothing left to send them.
+    """
+    drained = False
+    try:
+        with app.app_context():
+            while True:
+                with _pending_lock:
+                    score, on_sent = _pending_grades[key]
+                    _pending_grades[key] = None     # in flight, nothing newer yet
+                try:
+                    success, msg = _send_grade_with_retry(key[0], key[1], score)
+                    if not success:
+                        app.logger.warning(f'Grade passback failed: {msg}')
+                    elif on_sent is not None:
+                        on_sent(key[0], key[1], score)
+                except Exception:
+                    app.logger.exception('Grade passback for %s crashed', key[1])
+                with _pending_lock:
+                    if _pending_grades[key] is None:
+                        del _pending_grades[key]
+                        drained = True
+                        return
+    finally:
+        if not drained:
+            # Left abnormally: drop the key, or hand a newer score to a new drain
+            with _pending_lock:
+                pending = _pending_grades.get(key)
+                if pending is None:
+                    _pending_grades.pop(key, None)
+            if pending is not None:
+                _grade_pool.submit(_drain_grades, app, key)
+
+
+def enqueue_grade(outcome_url, sourcedid, score, on_sent=None):
+    """Queue a grade passback and return immediately.
+
+    Passbacks run on a small worker pool.  At most one send per result
+    (outcome_url, sourcedid) is in flight; grades queued meanwhile are
+    coalesced so only the newest score is sent next, keeping Moodle's
+    final value in submission order.
+
+    `on_sent(outcome_url, sourcedid, score)`, if given, is called in the
+    worker's app context once Moodle has accepted the score.
+
+    Must be called inside an application context.
+    """
+    key = (outcome_url, sourcedid)
+    with _pending_lock:
+        queued = key in _pending_grades
+        _pending_grades[key] = (score, on_sent)
+    if not queued:
+        _grade_pool.submit(_drain_grades, current_app._get_current_object(), key)
@@ -1,9 +1,16 @@
+from functools import cached_property
+import orjson
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
 
 db = SQLAlchemy()
 
 
+def utcnow():
+    """Timezone-aware current UTC time; the shared created_at default."""
+    return datetime.now(timezone.utc)
+
+
 def get_current_semester():
     """Retrieve the current active semester from the system settings."""
     try:
@@ -25,7 +32,7 @@ class User(db.Model):
     name = db.Column(db.String(255), default='Unknown')
     email = db.Column(db.String(255), default='')
     role = db.Column(db.String(50), default='student')  # 'student' or 'instructor'
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=utcnow)
 
     submissions = db.relationship('Submission', backref='user', lazy='dynamic')
     lti_sessions = db.relationship('LTISession', backref='user', lazy='dynamic')
@@ -44,12 +51,18 @@ class Problem(db.Model):
     time_limit_ms = db.Column(db.Integer, default=2000)  # milliseconds
     memory_limit_mb = db.Column(db.Integer, default=256)  # megabytes
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=utcnow)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
     is_active = db.Column(db.Boolean, default=True)
     solution_code = db.Column(db.Text, default='')       # correct solution for generator
     solution_language = db.Column(db.String(20), default='c')
     code_template = db.Column(db.Text, default='')       # template with lock markers
 
+    __table_args__ = (
+        db.Index('ix_problem_created_at', 'created_at'),
+        db.Index('ix_problem_updated_at', 'updated_at'),
+    )
+
     test_cases = db.relationship('TestCase', backref='problem', lazy='dynamic',
                                  cascade='all, delete-orphan')
     images = db.relationship('ProblemImage', backref='problem', lazy='dynamic',
@@ -67,9 +80,9 @@ class ProblemImage(db.Model):
     __tablename__ = 'problem_images'
 
     id = db.Column(db.Integer, primary_key=True)
-    problem_id = db.Column(db.Integer, db.ForeignKey('problems.id'), nullable=False, index=True)
+    problem_id = db.Column(db.Integer, db.ForeignKey('problems.id', ondelete='CASCADE'), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=utcnow)
 
     def __repr__(self):
         return f'<ProblemImage {self.filename} for Problem {self.problem_id}>'
@@ -80,12 +93,19 @@ class TestCase(db.Model):
     __tablename__ = 'test_cases'
 
     id = db.Column(db.Integer, primary_key=True)
-    problem_id = db.Column(db.Integer, db.ForeignKey('problems.id'), nullable=False, index=True)
+    problem_id = db.Column(db.Integer, db.ForeignKey('problems.id', ondelete='CASCADE'), nullable=False, index=True)
     input_data = db.Column(db.Text, nullable=False)
     expected_output = db.Column(db.Text, nullable=False)
     is_sample = db.Column(db.Boolean, default=False)  # Visible to students
     order = db.Column(db.Integer, default=0)
 
+    __table_args__ = (
+        db.Index('ix_testcase_problem_order', 'problem_id', 'order'),
+        # Just the samples, already in display order (problem page, result page)
+        db.Index('ix_testcase_problem_samples', 'problem_id', 'order',
+                 sqlite_where=is_sample == True, postgresql_where=is_sample == True),
+    )
+
     def __repr__(self):
         return f'<TestCase #{self.id} for Problem {self.problem_id}>'
 
@@ -96,19 +116,33 @@ class Submission(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
-    problem_id = db.Column(db.Integer, db.ForeignKey('problems.id'), nullable=False, index=True)
+    problem_id = db.Column(db.Integer, db.ForeignKey('problems.id', ondelete='CASCADE'), nullable=False, index=True)
     code = db.Column(db.Text, nullable=False)
     language = db.Column(db.String(20), nullable=False)  # 'python', 'c', 'cpp'
     verdict = db.Column(db.String(20), default='PENDING', index=True)  # AC, WA, TLE, RE, CE, PENDING
     semester = db.Column(db.String(50), nullable=False, index=True, default=get_current_semester)
 
     __table_args__ = (
-        db.Index('ix_submission_user_problem', 'user_id', 'problem_id'),
+        # A user's submissions to one problem, newest first (problem page,
+        # latest code) and the AC probes at grade passback
+        db.Index('ix_submission_user_problem_created', 'user_id', 'problem_id', 'created_at'),
+        db.Index('ix_submission_user_problem_verdict', 'user_id', 'problem_id', 'verdict'),
+        # All of a user's submissions, newest first (my submissions)
+        db.Index('ix_submission_user_created', 'user_id', 'created_at'),
+        db.Index('ix_submission_problem_created', 'problem_id', 'created_at'),
     )
     score = db.Column(db.Float, default=0.0)  # 0.0 to 1.0
     results_json = db.Column(db.Text, default='[]')  # Per-test-case results as JSON
     error_message = db.Column(db.Text, default='')
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=utcnow)
+
+    @cached_property
+    def parsed_results(self):
+        """Per-test-case results, decoded from results_json on first access."""
+        try:
+            return orjson.loads(self.results_json) if self.results_json else []
+        except (orjson.JSONDecodeError, TypeError):
+            return []
 
     def __repr__(self):
         return f'<Submission #{self.id} {self.verdict}>'
@@ -125,7 +159,8 @@ class LTISession(db.Model):
     resource_link_id = db.Column(db.String(255), default='')  # Moodle activity ID
     outcome_service_url = db.Column(db.Text, default='')  # For grade passback
     result_sourcedid = db.Column(db.Text, default='')  # For grade passback
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    last_grade_sent = db.Column(db.Float, nullable=True)  # Last grade Moodle accepted for this result
+    created_at = db.Column(db.DateTime, default=utcnow)
 
     def __repr__(self):
         return f'<LTISession user={self.user_id} problem={self.problem_id}>'
@@ -151,7 +186,7 @@ class SharedLink(db.Model):
     title = db.Column(db.String(255), default='Practice Sheet')
     problem_ids = db.Column(db.Text, nullable=False)  # comma-separated list of problem IDs
     semester = db.Column(db.String(50), nullable=False, index=True, default=get_current_semester)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=utcnow)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
     screenshare_required = db.Column(db.Boolean, default=False)
@@ -174,8 +209,8 @@ class ProctorSession(db.Model):
     is_screen_active = db.Column(db.Boolean, default=True)
     paste_count = db.Column(db.Integer, default=0)
 
-    last_seen_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    last_seen_at = db.Column(db.DateTime, default=utcnow, index=True)
+    created_at = db.Column(db.DateTime, default=utcnow)
 
     user = db.relationship('User', backref='proctor_sessions')
     problem = db.relationship('Problem', backref='proctor_sessions')
@@ -194,7 +229,7 @@ class ProctorEvent(db.Model):
     event_type = db.Column(db.String(50), nullable=False)  # SCREEN_STOPPED, PASTE_EVENT, LOCKED, UNLOCKED
     details = db.Column(db.Text, default='')
     frame_snapshot = db.Column(db.Text, nullable=True)  # Proof snapshot image base64 if applicable
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=utcnow)
 
     def __repr__(self):
         return f'<ProctorEvent {self.event_type} for Session {self.proctor_session_id}>'
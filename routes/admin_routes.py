@@ -6,36 +6,58 @@ uploading images, and generating test-case output.
 """
 
 import os
-import json
-import uuid
+import re
+import random
+import shutil
+import string
+import secrets
+import hashlib
 import tempfile
 from collections import defaultdict
+import orjson
 from flask import (Blueprint, render_template, request, redirect,
-                   url_for, flash, session, current_app, jsonify)
+                   url_for, flash, session, current_app, jsonify, make_response)
 from werkzeug.utils import secure_filename
-from sqlalchemy import func
-from sqlalchemy.orm import joinedload
-from models.database import db, Problem, TestCase, Submission, User, ProblemImage, SharedLink, SystemSetting
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import joinedload, contains_eager
+from models.database import db, utcnow, Problem, TestCase, Submission, User, ProblemImage, SharedLink, SystemSetting
 from lti.auth import require_instructor
-from judge.runner import compile_code, run_test_case
+from judge.runner import (compile_code, build_run_command, run_test_case,
+                          run_inputs, write_input_file, remove_work_dir)
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'svg', 'webp'}
 
+# One or more blank lines separate the inputs in a generate_batch payload
+_BATCH_SPLIT_RE = re.compile(r'\n{2,}')
+
 
 def _token_redirect(endpoint, **kwargs):
     """redirect() that propagates the _lt session token."""
-    token = getattr(request, '_session_token', '') or request.args.get('_lt', '')
+    # Resolved once per request by the app-level before_request hook
+    token = getattr(request, '_session_token', '')
     if token:
         kwargs['_lt'] = token
     return redirect(url_for(endpoint, **kwargs))
 
 
+def _json_response(payload):
+    """jsonify() via orjson, for responses that carry program output."""
+    return current_app.response_class(orjson.dumps(payload), mimetype='application/json')
+
+
 def _allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def _next_test_case_order(problem_id):
+    """Return the order value for a new test case appended to a problem."""
+    return db.session.query(
+        func.coalesce(func.max(TestCase.order), -1) + 1
+    ).filter(TestCase.problem_id == problem_id).scalar()
+
+
 def _uploads_dir(problem_id):
     """Return (and create) the upload directory for a problem."""
     base = os.path.join(current_app.root_path, 'static', 'uploads', str(problem_id))
@@ -45,10 +67,43 @@ def _uploads_dir(problem_id):
 
 # ── Dashboard ────────────────────────────────────────────────────────
 
+def _dashboard_etag(active_semester):
+    """Fingerprint everything the dashboard renders.
+
+    Only index lookups: MAX(updated_at) covers problem edits, the MAX(id)
+    values cover added problems, test cases and submissions, and the
+    problem count (a small table) covers deleted problems.  Deleting a
+    test case touches its problem.  The session and launch token cover
+    the navbar and the links on the page.
+    """
+    stats = db.session.query(
+        select(func.count(Problem.id)).scalar_subquery(),
+        select(func.max(Problem.id)).scalar_subquery(),
+        select(func.max(Problem.updated_at)).scalar_subquery(),
+        select(func.max(TestCase.id)).scalar_subquery(),
+        select(func.max(Submission.id)).scalar_subquery(),
+    ).one()
+    session_state = sorted(kv for kv in session.items() if kv[0] != '_flashes')
+    state = (tuple(stats), active_semester, session_state,
+             getattr(request, '_session_token', ''))
+    return hashlib.sha1(repr(state).encode('utf-8')).hexdigest()
+
+
 @admin_bp.route('/dashboard')
 @require_instructor
 def dashboard():
     """List all problems."""
+    active_sem_setting = SystemSetting.query.filter_by(key='current_semester').first()
+    active_semester = active_sem_setting.value if active_sem_setting else 'Summer 2025/2026'
+
+    # Unchanged dashboard: answer 304 before loading any problem rows.
+    # Pending flash messages must be rendered, so never skip those.
+    etag = _dashboard_etag(active_semester)
+    if request.if_none_match.contains(etag) and '_flashes' not in session:
+        resp = current_app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+
     problems = Problem.query.order_by(Problem.created_at.desc()).all()
 
     # Pre-compute counts with 2 aggregate queries (instead of 2N lazy .count() calls)
@@ -64,10 +119,13 @@ def dashboard():
         p.tc_count = tc_counts.get(p.id, 0)
         p.sub_count = sub_counts.get(p.id, 0)
 
-    active_sem_setting = SystemSetting.query.filter_by(key='current_semester').first()
-    active_semester = active_sem_setting.value if active_sem_setting else 'Summer 2025/2026'
-
-    return render_template('admin/dashboard.html', problems=problems, active_semester=active_semester)
+    resp = make_response(render_template('admin/dashboard.html', problems=problems,
+                                          active_semester=active_semester))
+    resp.set_etag(etag)
+    # Always revalidate: edits elsewhere must show up on the next visit
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp
 
 
 # ── Create / Edit Problem ────────────────────────────────────────────
@@ -88,9 +146,13 @@ def new_problem():
             created_by=session['user_id'],
         )
         db.session.add(problem)
+        # Take the id from the INSERT; reading it after commit would
+        # reload the expired row with another SELECT
+        db.session.flush()
+        problem_id = problem.id
         db.session.commit()
         flash('Problem created successfully!', 'success')
-        return _token_redirect('admin.edit_problem', problem_id=problem.id)
+        return _token_redirect('admin.edit_problem', problem_id=problem_id)
 
     languages = current_app.config['SUPPORTED_LANGUAGES']
     return render_template('admin/problem_form.html', problem=None,
@@ -146,10 +208,11 @@ def upload_image(problem_id):
     # Generate a unique filename to avoid collisions
     ext = file.filename.rsplit('.', 1)[1].lower()
     safe_name = secure_filename(file.filename.rsplit('.', 1)[0])
-    unique_name = f"{safe_name}_{uuid.uuid4().hex[:8]}.{ext}"
+    unique_name = f"{safe_name}_{secrets.token_hex(4)}.{ext}"
 
     dest = os.path.join(_uploads_dir(problem.id), unique_name)
-    file.save(dest)
+    # Copy the spooled upload in 512 KB chunks rather than Werkzeug's 16 KB
+    file.save(dest, buffer_size=512 * 1024)
 
     img = ProblemImage(problem_id=problem.id, filename=unique_name)
     db.session.add(img)
@@ -170,8 +233,10 @@ def delete_image(problem_id, img_id):
 
     # Remove file from disk
     filepath = os.path.join(_uploads_dir(problem_id), img.filename)
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    try:
+        os.unlink(filepath)
+    except FileNotFoundError:
+        pass
 
     db.session.delete(img)
     db.session.commit()
@@ -192,9 +257,10 @@ def add_test_case(problem_id):
         input_data=request.form.get('input_data', ''),
         expected_output=request.form.get('expected_output', ''),
         is_sample='is_sample' in request.form,
-        order=TestCase.query.filter_by(problem_id=problem.id).count(),
+        order=_next_test_case_order(problem.id),
     )
     db.session.add(tc)
+    problem.updated_at = utcnow()     # refreshes cached student views of the samples
     db.session.commit()
     flash('Test case added!', 'success')
     return _token_redirect('admin.edit_problem', problem_id=problem.id)
@@ -209,6 +275,7 @@ def delete_test_case(problem_id, tc_id):
         flash('Invalid test case.', 'error')
         return _token_redirect('admin.edit_problem', problem_id=problem_id)
 
+    tc.problem.updated_at = utcnow()     # dashboard counts and cached samples
     db.session.delete(tc)
     db.session.commit()
     flash('Test case deleted.', 'success')
@@ -233,18 +300,18 @@ def generate_output(problem_id):
     if not lang_config:
         return jsonify({'error': f'Unsupported language: {language}'}), 400
 
-    work_dir = tempfile.mkdtemp(prefix='gen_')
+    work_dir = tempfile.mkdtemp(prefix='gen_',
+                                dir=current_app.config.get('JUDGE_WORK_DIR') or None)
     try:
         # Compile
-        success, exe_path, err = compile_code(problem.solution_code, language, work_dir)
+        success, exe_path, err = compile_code(problem.solution_code, language, work_dir, lang_config)
         if not success:
             return jsonify({'error': f'Compilation error:\n{err}'}), 400
 
         # Run with the given input
         result = run_test_case(
-            executable_path=exe_path,
-            language=language,
-            input_data=input_data,
+            cmd_list=build_run_command(exe_path, lang_config),
+            input_path=write_input_file(os.path.join(work_dir, 'input.txt'), input_data),
             expected_output='',       # we don't know expected yet
             test_case_id=0,
             time_limit_s=problem.time_limit_ms / 1000,
@@ -257,11 +324,10 @@ def generate_output(problem_id):
         if result.verdict == 'TLE':
             return jsonify({'error': 'Time limit exceeded.'}), 400
 
-        return jsonify({'output': result.actual_output_full})
+        return _json_response({'output': result.actual_output_full})
 
     finally:
-        import shutil
-        shutil.rmtree(work_dir, ignore_errors=True)
+        remove_work_dir(work_dir)
 
 
 # ── Batch Test Case Generator ────────────────────────────────────────
@@ -270,8 +336,6 @@ def generate_output(problem_id):
 @require_instructor
 def generate_batch(problem_id):
     """Split bulk input on blank lines, run each, and save as test cases."""
-    import shutil
-
     problem = Problem.query.get_or_404(problem_id)
 
     if not problem.solution_code:
@@ -288,59 +352,61 @@ def generate_batch(problem_id):
     # Split on double-newline (blank line) to get individual test case inputs.
     # Normalize line endings first.
     bulk_input = bulk_input.replace('\r\n', '\n')
-    raw_parts = bulk_input.split('\n\n')
-    inputs = [p.strip() for p in raw_parts if p.strip()]
+    inputs = [p for p in map(str.strip, _BATCH_SPLIT_RE.split(bulk_input)) if p]
 
     if not inputs:
         return jsonify({'error': 'No test case inputs provided.'}), 400
 
-    work_dir = tempfile.mkdtemp(prefix='gen_batch_')
+    work_dir = tempfile.mkdtemp(prefix='gen_batch_',
+                                dir=current_app.config.get('JUDGE_WORK_DIR') or None)
     try:
         # Compile once
-        success, exe_path, err = compile_code(problem.solution_code, language, work_dir)
+        success, exe_path, err = compile_code(problem.solution_code, language, work_dir, lang_config)
         if not success:
             return jsonify({'error': f'Compilation error:\n{err}'}), 400
 
         added = 0
         errors = []
-        current_order = TestCase.query.filter_by(problem_id=problem.id).count()
-
-        for idx, inp in enumerate(inputs):
-            result = run_test_case(
-                executable_path=exe_path,
-                language=language,
-                input_data=inp,
-                expected_output='',
-                test_case_id=idx,
-                time_limit_s=problem.time_limit_ms / 1000,
-                memory_limit_mb=problem.memory_limit_mb,
-                work_dir=work_dir,
-            )
+        current_order = _next_test_case_order(problem.id)
+
+        # Run every input concurrently on the judge's shared pool
+        results = run_inputs(
+            cmd_list=build_run_command(exe_path, lang_config),
+            inputs=inputs,
+            time_limit_s=problem.time_limit_ms / 1000,
+            memory_limit_mb=problem.memory_limit_mb,
+            work_dir=work_dir,
+        )
 
+        rows = []
+        for idx, (inp, result) in enumerate(zip(inputs, results)):
             if result.verdict in ('RE', 'TLE'):
                 err_msg = result.error if result.verdict == 'RE' else 'Time limit exceeded'
                 errors.append(f'Test case #{idx + 1}: {err_msg}')
                 continue
 
-            tc = TestCase(
-                problem_id=problem.id,
-                input_data=inp,
-                expected_output=result.actual_output_full,
-                is_sample=is_sample,
-                order=current_order + added,
-            )
-            db.session.add(tc)
+            rows.append({
+                'problem_id': problem.id,
+                'input_data': inp,
+                'expected_output': result.actual_output_full,
+                'is_sample': is_sample,
+                'order': current_order + added,
+            })
             added += 1
 
+        # One executemany INSERT instead of per-object unit-of-work flushes
+        if rows:
+            db.session.execute(insert(TestCase), rows)
+            problem.updated_at = utcnow()     # as in add_test_case()
         db.session.commit()
 
         resp = {'added': added, 'total': len(inputs)}
         if errors:
             resp['errors'] = errors
-        return jsonify(resp)
+        return _json_response(resp)
 
     finally:
-        shutil.rmtree(work_dir, ignore_errors=True)
+        remove_work_dir(work_dir)
 
 
 # ── Submissions & Delete ─────────────────────────────────────────────
@@ -372,17 +438,15 @@ def view_submissions(problem_id):
     if selected_semester != 'All':
         query = query.filter_by(semester=selected_semester)
         
-    submissions = query.options(joinedload(Submission.user))\
-        .order_by(Submission.created_at.desc()).all()
-
-    for sub in submissions:
-        try:
-            sub.parsed_results = json.loads(sub.results_json) if sub.results_json else []
-        except json.JSONDecodeError:
-            sub.parsed_results = []
+    # Page through the history so only one screenful of rows (and their
+    # results JSON) is loaded and rendered per request
+    pagination = query.options(joinedload(Submission.user, innerjoin=True))\
+        .order_by(Submission.created_at.desc())\
+        .paginate(page=request.args.get('page', 1, type=int), per_page=50, error_out=False)
 
     return render_template('admin/submissions.html',
-                           problem=problem, submissions=submissions, filter_user=filter_user,
+                           problem=problem, submissions=pagination.items, pagination=pagination,
+                           filter_user=filter_user,
                            semesters=clean_semesters, selected_semester=selected_semester, active_semester=active_semester)
 
 
@@ -422,18 +486,13 @@ def all_submissions():
             (Problem.title.ilike(f'%{q}%'))
         )
 
+    # Populate user/problem from the joins above rather than joining again
     submissions = query.options(
-        joinedload(Submission.user),
-        joinedload(Submission.problem)
+        contains_eager(Submission.user),
+        contains_eager(Submission.problem)
     ).order_by(Submission.created_at.desc()).limit(250).all()
 
-    for sub in submissions:
-        try:
-            sub.parsed_results = json.loads(sub.results_json) if sub.results_json else []
-        except (json.JSONDecodeError, TypeError):
-            sub.parsed_results = []
-
-    verdicts = ['AC', 'WA', 'TLE', 'MLE', 'RE', 'CE']
+    verdicts = ['AC', 'WA', 'TLE', 'MLE', 'RE', 'CE', 'PENDING']
 
     return render_template('admin/all_submissions.html',
                            submissions=submissions,
@@ -544,9 +603,6 @@ def change_semester():
 @require_instructor
 def shared_links():
     """List and manage practice links (direct regnum sheets)."""
-    import random
-    import string
-    
     active_sem_setting = SystemSetting.query.filter_by(key='current_semester').first()
     active_semester = active_sem_setting.value if active_sem_setting else 'Summer 2025/2026'
     
@@ -565,7 +621,7 @@ def shared_links():
         chars = string.ascii_letters + string.digits
         while True:
             code = ''.join(random.choices(chars, k=6))
-            if not SharedLink.query.filter_by(code=code).first():
+            if not db.session.query(SharedLink.query.filter_by(code=code).exists()).scalar():
                 break
                 
         new_link = SharedLink(
@@ -645,16 +701,15 @@ def reset_student_submissions(user_id):
 def delete_problem(problem_id):
     """Delete a problem and all its test cases and submissions."""
     problem = Problem.query.get_or_404(problem_id)
-    # Delete submissions first
-    Submission.query.filter_by(problem_id=problem_id).delete()
-    # Delete test cases (cascade should handle this, but be explicit)
-    TestCase.query.filter_by(problem_id=problem_id).delete()
+    # Bulk DELETEs up front so the ORM cascade on problem below finds
+    # nothing to load.  Kept explicit because SQLite only honours
+    # ON DELETE CASCADE with foreign_keys enabled.
+    Submission.query.filter_by(problem_id=problem_id).delete(synchronize_session=False)
+    TestCase.query.filter_by(problem_id=problem_id).delete(synchronize_session=False)
     # Delete images from disk
-    import shutil
     uploads = os.path.join(current_app.root_path, 'static', 'uploads', str(problem_id))
-    if os.path.exists(uploads):
-        shutil.rmtree(uploads, ignore_errors=True)
-    ProblemImage.query.filter_by(problem_id=problem_id).delete()
+    shutil.rmtree(uploads, ignore_errors=True)
+    ProblemImage.query.filter_by(problem_id=problem_id).delete(synchronize_session=False)
     db.session.delete(problem)
     db.session.commit()
     flash('Problem deleted.', 'success')
@@ -6,6 +6,10 @@ creates/updates user, stores session data, and redirects
 based on role.
 """
 
+import json
+import time
+from functools import lru_cache
+from markupsafe import escape
 from flask import Blueprint, request, session, redirect, url_for, render_template, make_response, current_app
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from models.database import db, User, LTISession, Problem
@@ -25,19 +29,70 @@ def _make_launch_token(data):
     return s.dumps(data, salt='lti-launch')
 
 
+# Tokens minted for cookie sessions, reused for up to an hour so we don't
+# re-sign identical session data on every request.
+# key: (secret, session data) -> (token, minted_at)
+_LAUNCH_TOKEN_CACHE = {}
+_LAUNCH_TOKEN_REUSE_SECONDS = 3600
+
+
+def _cached_launch_token(data):
+    """Return a launch token for `data`, reusing a recently minted one.
+
+    A reused token is at most an hour old, so links rendered with it
+    stay valid for at least 23 of the token's 24 hours.
+    """
+    key = (current_app.config['SECRET_KEY'],
+           tuple((k, tuple(v) if isinstance(v, list) else v)
+                 for k, v in sorted(data.items())))
+    now = time.time()
+    cached = _LAUNCH_TOKEN_CACHE.get(key)
+    if cached and now - cached[1] < _LAUNCH_TOKEN_REUSE_SECONDS:
+        return cached[0]
+
+    if len(_LAUNCH_TOKEN_CACHE) >= 1024:
+        _LAUNCH_TOKEN_CACHE.clear()
+    token = _make_launch_token(data)
+    _LAUNCH_TOKEN_CACHE[key] = (token, now)
+    return token
+
+
 def verify_launch_token(token, max_age=86400):
     """Verify and decode a launch token.
 
     Returns the payload dict, or None if invalid / expired.
     Default max_age is 24 hours.
+
+    Cookie-less clients send the same token on every navigation, so
+    results are memoized for up to 30 seconds (the cache key includes
+    a 30-second time bucket); a token may therefore be honoured up to
+    30 seconds past max_age.
     """
-    s = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
+    return _verify_launch_token_cached(
+        token, current_app.config['SECRET_KEY'], max_age, int(time.time() // 30)
+    )
+
+
+@lru_cache(maxsize=1024)
+def _verify_launch_token_cached(token, secret_key, max_age, _time_bucket):
+    s = URLSafeTimedSerializer(secret_key)
     try:
         return s.loads(token, salt='lti-launch', max_age=max_age)
     except (BadSignature, SignatureExpired):
         return None
 
 
+_REDIRECT_HTML = """<!DOCTYPE html>
+<html>
+<head><title>Redirecting…</title></head>
+<body>
+<p>Redirecting…</p>
+<script>window.location.replace(%(js_url)s);</script>
+<noscript><a href="%(href)s">Click here to continue</a></noscript>
+</body>
+</html>"""
+
+
 def _client_side_redirect(target_url):
     """Return an HTML page that redirects via JavaScript.
 
@@ -46,17 +101,16 @@ def _client_side_redirect(target_url):
     cookie in the response *and* redirecting via JS, the browser stores
     the cookie before navigating.
     """
-    html = f"""<!DOCTYPE html>
-<html>
-<head><title>Redirecting…</title></head>
-<body>
-<p>Redirecting…</p>
-<script>window.location.replace("{target_url}");</script>
-<noscript><a href="{target_url}">Click here to continue</a></noscript>
-</body>
-</html>"""
+    html = _REDIRECT_HTML % {
+        # A JS string literal inside <script>: JSON-quote it and keep
+        # "</" from closing the script element
+        'js_url': json.dumps(target_url).replace('<', '\\u003c'),
+        'href': escape(target_url),
+    }
     resp = make_response(html, 200)
-    resp.headers['Content-Type'] = 'text/html'
+    resp.headers['Content-Type'] = 'text/html; charset=utf-8'
+    # The page carries a session token; never let a browser cache it
+    resp.headers['Cache-Control'] = 'no-store'
     return resp
 
 
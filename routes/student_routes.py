@@ -4,25 +4,40 @@ Student Routes.
 Problem viewing, code submission, and submission history.
 """
 
-import json
+import time
+import weakref
 import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import orjson
 from flask import (Blueprint, render_template, request, redirect,
-                   url_for, flash, session, current_app, jsonify)
+                   url_for, flash, session, current_app, jsonify, abort)
 
 from datetime import datetime, timezone, timedelta
-from sqlalchemy import func, case
-from sqlalchemy.orm import joinedload
+from sqlalchemy import func, case, and_
+from sqlalchemy.orm import load_only, selectinload
 from models.database import db, Problem, TestCase, Submission, LTISession, SharedLink, User, SystemSetting, ProctorSession
 from lti.auth import require_lti_session
-from lti.outcomes import send_grade
+from lti.outcomes import enqueue_grade
 from judge.runner import judge_submission
 
 student_bp = Blueprint('student', __name__)
 
+# Lightweight stand-in for a user's best submission on the problem list
+_BestSubmission = namedtuple('_BestSubmission', 'verdict score')
+
+# Read-only snapshots of a problem and its samples, shared between requests
+_ProblemView = namedtuple('_ProblemView', 'id title description time_limit_ms '
+                                          'memory_limit_mb code_template is_active')
+_SampleCase = namedtuple('_SampleCase', 'input_data expected_output')
+# app -> {problem_id: (expiry, updated_at, _ProblemView, samples)}
+_problem_view_cache = weakref.WeakKeyDictionary()
+
 
 def _token_redirect(endpoint, **kwargs):
     """redirect() that propagates the _lt session token."""
-    token = getattr(request, '_session_token', '') or request.args.get('_lt', '')
+    # Resolved once per request by the app-level before_request hook
+    token = getattr(request, '_session_token', '')
     if token:
         kwargs['_lt'] = token
     return redirect(url_for(endpoint, **kwargs))
@@ -48,6 +63,48 @@ def _get_active_semester():
     return setting.value if setting else 'Summer 2025/2026'
 
 
+def _get_problem_view(problem_id):
+    """Return (problem, sample_cases) for the student pages, or abort 404.
+
+    The statement and samples are the same for every student, so they are
+    kept per app for PROBLEM_CACHE_TTL seconds. Each call still reads
+    is_active and updated_at by primary key, so closing or editing a
+    problem, or adding or deleting its test cases (which touch
+    updated_at), takes effect at once in every worker process.
+    """
+    head = db.session.query(Problem.is_active, Problem.updated_at)\
+        .filter(Problem.id == problem_id).first()
+    if head is None:
+        abort(404)
+    is_active, updated_at = head
+
+    ttl = current_app.config['PROBLEM_CACHE_TTL']
+    cache = _problem_view_cache.setdefault(current_app._get_current_object(), {})
+    now = time.monotonic()
+    entry = cache.get(problem_id)
+    if entry and entry[0] > now and entry[1] == updated_at:
+        problem = entry[2]
+        if problem.is_active != is_active:
+            problem = problem._replace(is_active=is_active)
+        return problem, entry[3]
+
+    row = db.session.query(
+        Problem.id, Problem.title, Problem.description, Problem.time_limit_ms,
+        Problem.memory_limit_mb, Problem.code_template,
+    ).filter(Problem.id == problem_id).first()
+    if row is None:
+        abort(404)
+    problem = _ProblemView(*row, is_active)
+    sample_cases = tuple(_SampleCase(*tc) for tc in db.session.query(
+        TestCase.input_data, TestCase.expected_output
+    ).filter_by(problem_id=problem_id, is_sample=True).order_by(TestCase.order))
+
+    if ttl > 0:
+        if len(cache) > 512:
+            cache.clear()
+        cache[problem_id] = (now + ttl, updated_at, problem, sample_cases)
+    return problem, sample_cases
+
 
 @student_bp.route('/problems')
 @require_lti_session
@@ -59,15 +116,19 @@ def problem_list():
     if is_single:
         return _token_redirect('student.view_problem', problem_id=locked_ids[0])
 
+    # The list only shows these columns; skip the statement/solution blobs
+    query = Problem.query.options(load_only(
+        Problem.id, Problem.title, Problem.time_limit_ms, Problem.memory_limit_mb))
+
     # Multi-problem sheet: filter to sheet problems only
     if locked_ids:
-        problems = Problem.query.filter(
+        problems = query.filter(
             Problem.id.in_(locked_ids),
             Problem.is_active == True
         ).order_by(Problem.id.asc()).all()
     else:
         # No lock — show all active problems
-        problems = Problem.query.filter_by(is_active=True)\
+        problems = query.filter_by(is_active=True)\
             .order_by(Problem.created_at.desc()).all()
 
     # Get best submission for each problem in a SINGLE query (avoids N+1)
@@ -77,7 +138,8 @@ def problem_list():
     if problem_ids:
         best_subs = db.session.query(
             Submission.problem_id,
-            func.max(Submission.score).label('best_score'),
+            # Submissions still being judged have no score yet
+            func.max(case((Submission.verdict != 'PENDING', Submission.score))).label('best_score'),
             func.max(case((Submission.verdict == 'AC', 1), else_=0)).label('has_ac')
         ).filter(
             Submission.user_id == user_id,
@@ -93,11 +155,13 @@ def problem_list():
     for problem in problems:
         row = best_map.get(problem.id)
         if row:
-            # Create a lightweight object for the template
-            problem.user_best = type('Best', (), {
-                'verdict': 'AC' if row.has_ac else 'WA',
-                'score': row.best_score
-            })()
+            if row.has_ac:
+                verdict = 'AC'
+            elif row.best_score is None:
+                verdict = 'PENDING'     # only submission(s) still being judged
+            else:
+                verdict = 'WA'
+            problem.user_best = _BestSubmission(verdict, row.best_score)
             if row.has_ac:
                 solved_count += 1
         else:
@@ -123,40 +187,50 @@ def view_problem(problem_id):
         else:
             return _token_redirect('student.problem_list')
 
-    problem = Problem.query.get_or_404(problem_id)
+    problem, sample_cases = _get_problem_view(problem_id)
     if not problem.is_active and session.get('role') != 'instructor':
         return render_template('student/problem_closed.html',
                                problem=problem), 403
 
-    sample_cases = TestCase.query.filter_by(
-        problem_id=problem_id, is_sample=True
-    ).order_by(TestCase.order).all()
-
     languages = current_app.config['SUPPORTED_LANGUAGES']
 
-    # Get user's previous submissions
+    # Get user's previous submissions.  The list shows only these columns;
+    # the editor preloads the newest one's code, which is fetched on its own
+    # rather than dragging ten copies of source and results along.
     user_id = session['user_id']
-    submissions = Submission.query.filter_by(
+    submissions = Submission.query.options(load_only(
+        Submission.id, Submission.language, Submission.verdict,
+        Submission.score, Submission.created_at,
+    )).filter_by(
         user_id=user_id, problem_id=problem_id, semester=_get_active_semester()
     ).order_by(Submission.created_at.desc()).limit(10).all()
+    latest_code = db.session.query(Submission.code)\
+        .filter(Submission.id == submissions[0].id).scalar() if submissions else None
 
     return render_template('student/problem.html',
                            problem=problem,
                            sample_cases=sample_cases,
                            languages=languages,
-                           submissions=submissions)
+                           submissions=submissions,
+                           latest_code=latest_code)
 
 
 @student_bp.route('/api/problem/<int:problem_id>', methods=['GET'])
 @require_lti_session
 def api_get_problem(problem_id):
     """Return JSON details of a problem for dynamic AJAX switching."""
-    problem = Problem.query.get_or_404(problem_id)
-    sample_cases = TestCase.query.filter_by(problem_id=problem.id, is_sample=True).order_by(TestCase.order).all()
+    # Enforce navigation lock before touching the database
+    locked_ids, _ = _get_lock_info()
+    if locked_ids and problem_id not in locked_ids:
+        return jsonify({'error': 'Problem not available in this session.'}), 403
+
+    problem, sample_cases = _get_problem_view(problem_id)
 
     user_id = session.get('user_id')
     active_sem = _get_active_semester()
-    latest_sub = Submission.query.filter_by(user_id=user_id, problem_id=problem.id, semester=active_sem).order_by(Submission.created_at.desc()).first()
+    latest_sub = Submission.query.options(load_only(Submission.code, Submission.language))\
+        .filter_by(user_id=user_id, problem_id=problem.id, semester=active_sem)\
+        .order_by(Submission.created_at.desc()).first()
 
     return jsonify({
         'id': problem.id,
@@ -206,11 +280,170 @@ def _verify_locked_lines(submitted_code, template_code):
     return True, ""
 
 
+# ── Background judging ───────────────────────────────────────────────
+
+# Submissions are judged here rather than on the request thread, so a slow
+# compile or a TLE never holds a web worker.  Each job still fans its test
+# cases out over the judge's shared pool.
+_judge_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='submission')
+
+# Submissions queued on or running in _judge_pool in this process.  A busy
+# queue can hold a job past JUDGE_PENDING_TIMEOUT; those are not lost.
+_judging_ids = set()
+_judging_lock = threading.Lock()
+
+
+def _compute_grade(verdict, user_id, problem_id, locked_ids, lti_session_id, semester):
+    """Work out the Moodle grade for a freshly judged submission.
+
+    Returns:
+        tuple: (outcome_url, sourcedid, grade), or None when there is
+        nothing to pass back (not an LTI launch, no outcome service, or
+        Moodle already holds this grade)
+    """
+    if not lti_session_id:
+        return None
+    lti_sess = db.session.query(
+        LTISession.outcome_service_url, LTISession.result_sourcedid, LTISession.last_grade_sent
+    ).filter(LTISession.id == lti_session_id).first()
+    if not lti_sess or not lti_sess.outcome_service_url:
+        return None
+
+    if locked_ids and len(locked_ids) > 1:
+        # Multi-problem sheet: single query instead of loop
+        solved = Submission.query.filter(
+            Submission.user_id == user_id,
+            Submission.problem_id.in_(locked_ids),
+            Submission.verdict == 'AC',
+            Submission.semester == semester
+        ).with_entities(Submission.problem_id).distinct().count()
+        grade = solved / len(locked_ids)
+    else:
+        # Single problem or no lock: binary 1/0.  This submission
+        # settles it when accepted; otherwise probe for an earlier AC.
+        has_ac = verdict == 'AC' or db.session.query(
+            Submission.query.filter_by(
+                user_id=user_id,
+                problem_id=problem_id,
+                verdict='AC',
+                semester=semester
+            ).exists()
+        ).scalar()
+        grade = 1.0 if has_ac else 0.0
+
+    # Moodle already holds this grade (e.g. WA after WA, or AC after AC)
+    if lti_sess.last_grade_sent is not None and abs(grade - lti_sess.last_grade_sent) < 1e-9:
+        return None
+
+    return lti_sess.outcome_service_url, lti_sess.result_sourcedid, grade
+
+
+def _record_grade_sent(outcome_url, sourcedid, score):
+    """enqueue_grade() callback: remember the grade Moodle now holds.
+
+    Runs on the passback worker, so errors are logged and rolled back
+    here rather than raised; a missed record only costs a resend later.
+    """
+    try:
+        LTISession.query.filter_by(
+            outcome_service_url=outcome_url, result_sourcedid=sourcedid
+        ).update({'last_grade_sent': score}, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Could not record the grade sent for %s', sourcedid)
+
+
+def _save_verdict(submission_id, result):
+    """Write a judge_submission() result onto a PENDING submission (no commit).
+
+    Returns:
+        bool: False if the row was no longer PENDING and was left alone
+    """
+    return bool(Submission.query.filter_by(id=submission_id, verdict='PENDING').update({
+        'verdict': result['verdict'],
+        'score': result['score'],
+        'results_json': orjson.dumps(result['results']).decode('utf-8'),
+        'error_message': result['error'] or None,  # NULL unless something failed
+    }, synchronize_session=False))
+
+
+def _failed_result(message):
+    """A judge result for a submission that could not be judged."""
+    return {'verdict': 'RE', 'score': 0.0, 'results': [], 'error': message}
+
+
+def _judge_in_background(app, submission_id, judge_args, grade_args):
+    """Judge a PENDING submission, store its verdict and pass the grade back.
+
+    Runs on _judge_pool, whose futures nobody reads: every failure is
+    logged here and the row is failed rather than left PENDING.
+    """
+    with app.app_context():
+        try:
+            result = judge_submission(**judge_args)
+            if not _save_verdict(submission_id, result):
+                # Already failed (timed out); its verdict must not change now
+                db.session.rollback()
+                return
+            # The grade reads run in the same transaction (they see the
+            # update above); the passback is only queued once it is committed
+            passback = _compute_grade(result['verdict'], **grade_args)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Judging submission %s failed', submission_id)
+            try:
+                _save_verdict(submission_id, _failed_result('Internal judge error, please resubmit.'))
+                db.session.commit()
+            except Exception:
+                # Left PENDING; _fail_stale_pending() fails it once it times out
+                db.session.rollback()
+                app.logger.exception('Could not mark submission %s as failed', submission_id)
+            return
+        finally:
+            with _judging_lock:
+                _judging_ids.discard(submission_id)
+
+        if passback:
+            enqueue_grade(*passback, on_sent=_record_grade_sent)
+
+
+def _fail_stale_pending(submission_id, created_at):
+    """Fail a submission whose judge job was lost (worker restart, deploy).
+
+    Jobs live in this process's memory only, so a PENDING row older than
+    JUDGE_PENDING_TIMEOUT that is not queued here will never be judged.
+
+    Returns:
+        bool: True if the row was marked as failed
+    """
+    if created_at is None or submission_id in _judging_ids:
+        return False
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    timeout = timedelta(seconds=current_app.config['JUDGE_PENDING_TIMEOUT'])
+    if datetime.now(timezone.utc) - created_at < timeout:
+        return False
+
+    result = _failed_result('Judging was interrupted, please resubmit.')
+    updated = Submission.query.filter_by(id=submission_id, verdict='PENDING').update({
+        'verdict': result['verdict'],
+        'error_message': result['error'],
+    }, synchronize_session=False)
+    db.session.commit()
+    return bool(updated)
+
+
 @student_bp.route('/problem/<int:problem_id>/submit', methods=['POST'])
 @require_lti_session
 def submit_code(problem_id):
     """Submit code for judging."""
-    problem = Problem.query.get_or_404(problem_id)
+    # The statement and reference solution are not needed to judge
+    problem = Problem.query.options(load_only(
+        Problem.id, Problem.title, Problem.time_limit_ms, Problem.memory_limit_mb,
+        Problem.code_template, Problem.is_active,
+    )).get_or_404(problem_id)
     if not problem.is_active:
         return render_template('student/problem_closed.html',
                                problem=problem), 403
@@ -221,14 +454,15 @@ def submit_code(problem_id):
         now = datetime.now(timezone.utc)
         cutoff = now - timedelta(seconds=15)
 
-        proc_sess = ProctorSession.query.filter(
+        # Only whether such a session exists matters, not the row itself
+        screen_shared = db.session.query(ProctorSession.query.filter(
             ProctorSession.user_id == user_id,
             ProctorSession.is_screen_active == True,
             ProctorSession.status == 'ACTIVE',
             ProctorSession.last_seen_at >= cutoff
-        ).order_by(ProctorSession.last_seen_at.desc()).first()
+        ).exists()).scalar()
 
-        if not proc_sess:
+        if not screen_shared:
             flash('🔒 Screen monitoring is required. You must share your entire screen before submitting your code.', 'error')
             return _token_redirect('student.view_problem', problem_id=problem_id)
 
@@ -239,7 +473,8 @@ def submit_code(problem_id):
         flash('Please enter your code.', 'error')
         return _token_redirect('student.view_problem', problem_id=problem_id)
 
-    if language not in current_app.config['SUPPORTED_LANGUAGES']:
+    lang_config = current_app.config['SUPPORTED_LANGUAGES'].get(language)
+    if lang_config is None:
         flash('Unsupported language.', 'error')
         return _token_redirect('student.view_problem', problem_id=problem_id)
 
@@ -249,82 +484,64 @@ def submit_code(problem_id):
         flash(err_msg, 'error')
         return _token_redirect('student.view_problem', problem_id=problem_id)
 
-    # Get all test cases (not just samples)
-    test_cases = TestCase.query.filter_by(problem_id=problem_id)\
-        .order_by(TestCase.order).all()
+    # Get all test cases (not just samples) — only the columns the judge
+    # reads, as plain rows so they outlive this request's session
+    test_cases = db.session.query(
+        TestCase.id, TestCase.input_data, TestCase.expected_output
+    ).filter_by(problem_id=problem_id).order_by(TestCase.order).all()
 
     if not test_cases:
         flash('No test cases available for this problem.', 'error')
         return _token_redirect('student.view_problem', problem_id=problem_id)
 
-    # Run the judge
-    result = judge_submission(
+    judge_args = dict(
         code=code,
         language=language,
         test_cases=test_cases,
         time_limit_ms=problem.time_limit_ms,
         memory_limit_mb=problem.memory_limit_mb,
+        lang_config=lang_config,
     )
 
-    # Create submission record
+    # Record the submission as PENDING; the verdict is filled in by the judge pool
     active_sem = _get_active_semester()
     submission = Submission(
         user_id=session['user_id'],
         problem_id=problem_id,
         code=code,
         language=language,
-        verdict=result['verdict'],
-        score=result['score'],
-        results_json=json.dumps(result['results']),
-        error_message=result['error'],
+        verdict='PENDING',
+        score=0.0,
+        results_json='[]',
+        error_message=None,
         semester=active_sem,
     )
     db.session.add(submission)
+    # Take the id before commit expires the row (reading it after would reload it)
+    db.session.flush()
+    submission_id = submission.id
     db.session.commit()
 
-    # ---- Grade passback to Moodle (non-blocking) ----
-    locked_ids, is_single = _get_lock_info()
-    lti_session_id = session.get('lti_session_id')
-    if lti_session_id:
-        lti_sess = LTISession.query.get(lti_session_id)
-        if lti_sess and lti_sess.outcome_service_url:
-            if locked_ids and len(locked_ids) > 1:
-                # Multi-problem sheet: single query instead of loop
-                solved = Submission.query.filter(
-                    Submission.user_id == session['user_id'],
-                    Submission.problem_id.in_(locked_ids),
-                    Submission.verdict == 'AC',
-                    Submission.semester == active_sem
-                ).with_entities(Submission.problem_id).distinct().count()
-                grade = solved / len(locked_ids)
-            else:
-                # Single problem or no lock: binary 1/0
-                has_ac = Submission.query.filter_by(
-                    user_id=session['user_id'],
-                    problem_id=problem_id,
-                    verdict='AC',
-                    semester=active_sem
-                ).first() is not None
-                grade = 1.0 if has_ac else 0.0
-
-            # Fire grade passback in a background thread to avoid blocking
-            outcome_url = lti_sess.outcome_service_url
-            result_sourcedid = lti_sess.result_sourcedid
-            app = current_app._get_current_object()
-
-            def _send_grade_bg(app, outcome_url, result_sourcedid, grade):
-                with app.app_context():
-                    success, msg = send_grade(outcome_url, result_sourcedid, grade)
-                    if not success:
-                        app.logger.warning(f'Grade passback failed: {msg}')
-
-            threading.Thread(
-                target=_send_grade_bg,
-                args=(app, outcome_url, result_sourcedid, grade),
-                daemon=True
-            ).start()
-
-    return _token_redirect('student.view_result', submission_id=submission.id)
+    locked_ids, _ = _get_lock_info()
+    grade_args = dict(
+        user_id=session['user_id'],
+        problem_id=problem_id,
+        locked_ids=locked_ids,
+        lti_session_id=session.get('lti_session_id'),
+        semester=active_sem,
+    )
+    with _judging_lock:
+        _judging_ids.add(submission_id)
+    try:
+        _judge_pool.submit(_judge_in_background, current_app._get_current_object(),
+                           submission_id, judge_args, grade_args)
+    except RuntimeError:
+        # Pool shut down (process exiting): leave it to the stale check
+        with _judging_lock:
+            _judging_ids.discard(submission_id)
+        raise
+
+    return _token_redirect('student.view_result', submission_id=submission_id)
 
 
 @student_bp.route('/submission/<int:submission_id>')
@@ -346,27 +563,48 @@ def view_result(submission_id):
         flash('You do not have permission to view this submission.', 'error')
         return _token_redirect('student.problem_list')
 
-    problem = Problem.query.get(submission.problem_id)
+    if submission.verdict == 'PENDING':
+        # Commit expires the row, so a failed one is reloaded below
+        _fail_stale_pending(submission.id, submission.created_at)
 
-    # Parse results
-    try:
-        results = json.loads(submission.results_json) if submission.results_json else []
-    except json.JSONDecodeError:
-        results = []
-
-    # Get sample test cases for display
-    sample_cases = TestCase.query.filter_by(
-        problem_id=submission.problem_id, is_sample=True
-    ).order_by(TestCase.order).all()
-    sample_ids = {tc.id for tc in sample_cases}
+    # The page needs the problem's id and title plus the ids of its sample
+    # test cases (their results are shown to students): one joined query
+    rows = db.session.query(Problem.id, Problem.title, TestCase.id.label('sample_id'))\
+        .outerjoin(TestCase, and_(TestCase.problem_id == Problem.id,
+                                  TestCase.is_sample == True))\
+        .filter(Problem.id == submission.problem_id).all()
+    problem = rows[0] if rows else None
+    sample_ids = {row.sample_id for row in rows if row.sample_id is not None}
 
     return render_template('student/result.html',
                            submission=submission,
                            problem=problem,
-                           results=results,
+                           results=submission.parsed_results,
                            sample_ids=sample_ids)
 
 
+@student_bp.route('/submission/<int:submission_id>/status')
+@require_lti_session
+def submission_status(submission_id):
+    """Return a submission's verdict as JSON (polled while it is PENDING)."""
+    row = db.session.query(Submission.user_id, Submission.problem_id, Submission.verdict,
+                           Submission.created_at)\
+        .filter(Submission.id == submission_id).first()
+    if row is None:
+        abort(404)
+
+    # Same visibility rules as view_result
+    locked_ids, _ = _get_lock_info()
+    if (locked_ids and row.problem_id not in locked_ids) or \
+            (row.user_id != session['user_id'] and session.get('role') != 'instructor'):
+        return jsonify({'error': 'Submission not available.'}), 403
+
+    verdict = row.verdict
+    if verdict == 'PENDING' and _fail_stale_pending(submission_id, row.created_at):
+        verdict = 'RE'
+    return jsonify({'verdict': verdict})
+
+
 @student_bp.route('/submissions')
 @require_lti_session
 def my_submissions():
@@ -380,21 +618,27 @@ def my_submissions():
     user_id = session['user_id']
     active_sem = _get_active_semester()
 
+    # The table shows only these columns: leave the code/results text and
+    # the problem statement behind, and fetch each distinct problem once
+    # (a JOIN would repeat it on every row).
+    list_options = (
+        load_only(Submission.id, Submission.problem_id, Submission.language,
+                  Submission.verdict, Submission.score, Submission.created_at),
+        selectinload(Submission.problem).load_only(Problem.id, Problem.title),
+    )
+
+    query = Submission.query.filter_by(user_id=user_id, semester=active_sem)
     if locked_ids:
         # Sheet mode: show only submissions for sheet problems
-        submissions = Submission.query.filter(
-            Submission.user_id == user_id,
-            Submission.problem_id.in_(locked_ids),
-            Submission.semester == active_sem
-        ).options(
-            joinedload(Submission.problem)
-        ).order_by(Submission.created_at.desc()).limit(50).all()
-    else:
-        submissions = Submission.query.filter_by(user_id=user_id, semester=active_sem)\
-            .options(joinedload(Submission.problem))\
-            .order_by(Submission.created_at.desc()).limit(50).all()
+        query = query.filter(Submission.problem_id.in_(locked_ids))
+
+    # Page through the history instead of silently cutting it off at 50
+    pagination = query.options(*list_options)\
+        .order_by(Submission.created_at.desc())\
+        .paginate(page=request.args.get('page', 1, type=int), per_page=50, error_out=False)
 
-    return render_template('student/submissions.html', submissions=submissions)
+    return render_template('student/submissions.html',
+                           submissions=pagination.items, pagination=pagination)
 
 
 @student_bp.route('/sheet/<string:code>', methods=['GET', 'POST'])